@@ -1,7 +1,9 @@
 # ui/chat_app.py
-import os, time, requests, streamlit as st
+import json, os, queue, threading, time, requests, streamlit as st
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from UI.db import connect, list_conversations, create_conversation, rename_conversation, delete_conversation, \
-                  get_messages, append_user_message, append_assistant_message, first_user_to_title, DEFAULT_DB_PATH
+                  archive_conversation, ensure_share_token, get_messages, log_turn, first_user_to_title, DEFAULT_DB_PATH
 
 API_BASE = os.getenv("RISKQA_API_BASE", "http://localhost:8000")
 DB_PATH = os.getenv("RISKQA_DB_PATH", DEFAULT_DB_PATH)
@@ -13,22 +15,101 @@ st.session_state.setdefault("current_convo_id", None)
 st.session_state.setdefault("new_chat_mode", False)
 st.session_state.setdefault("menu_open_for", None)
 
+@st.cache_resource
+def _http() -> requests.Session:
+    # Shared keep-alive session: skips TCP setup on every API call
+    s = requests.Session()
+    s.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    return s
+
 def get_ip() -> str:
     try:
-        r = requests.get(f"{API_BASE}/whoami", timeout=3)
+        r = _http().get(f"{API_BASE}/whoami", timeout=3)
         if r.ok and "ip" in r.json(): return r.json()["ip"]
     except Exception:
         pass
     return "unknown"
 
 def ask_api(question: str) -> dict:
-    r = requests.post(f"{API_BASE}/ask", json={"question": question}, timeout=120)
+    r = _http().post(f"{API_BASE}/ask", json={"question": question}, timeout=120)
     r.raise_for_status()
     return r.json()
 
+def ask_api_stream(question: str, meta: dict):
+    """Yield answer deltas from /ask/stream; the final SSE frame (citations,
+    top_score, latency_ms, note) is collected into `meta`."""
+    with _http().post(f"{API_BASE}/ask/stream", json={"question": question},
+                      stream=True, timeout=120) as r:
+        r.raise_for_status()
+        for line in r.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            evt = json.loads(line[len("data: "):])
+            if evt.get("done"):
+                meta.update(evt)
+            elif evt.get("error"):
+                raise RuntimeError(evt["error"])
+            elif evt.get("delta"):
+                yield evt["delta"]
+
+@st.cache_resource
+def _pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=4)
+
+_STREAM_END = object()
+
+def ask_api_stream_bg(question: str, meta: dict):
+    """Run the /ask/stream network I/O on a pool worker and relay deltas
+    through a queue, so the Streamlit script thread only renders instead of
+    blocking on sockets for the whole generation."""
+    q = queue.Queue(maxsize=256)
+    # Set when the consumer goes away (a rerun aborts st.write_stream and
+    # drops this generator); lets the feeder stop blocking on a queue
+    # nobody drains and give its pool slot + HTTP connection back.
+    abandoned = threading.Event()
+
+    def _offer(item) -> bool:
+        while not abandoned.is_set():
+            try:
+                q.put(item, timeout=1.0)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _feed():
+        try:
+            for delta in ask_api_stream(question, meta):
+                if not _offer(delta):
+                    return  # abandoned mid-stream; closing the loop closes the response
+        except Exception as e:
+            _offer(e)
+        finally:
+            _offer(_STREAM_END)
+
+    _pool().submit(_feed)
+    try:
+        while True:
+            item = q.get()
+            if item is _STREAM_END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        abandoned.set()
+
+# --- shared resources / cached queries ---
+@st.cache_resource
+def _conn(path: str):
+    # One tuned connection shared across all sessions (WAL handles concurrency)
+    return connect(path)
+
+@st.cache_data(ttl=5, show_spinner=False)
+def _list(okey: str, show_archived: bool):
+    return list_conversations(_conn(DB_PATH), okey, limit=100, include_archived=show_archived)
+
 # --- session init ---
-if "conn" not in st.session_state:
-    st.session_state.conn = connect(DB_PATH)
 if "client_ip" not in st.session_state:
     st.session_state.client_ip = get_ip()
 if "auth_user" not in st.session_state:
@@ -38,7 +119,7 @@ def owner_key() -> str:
     return f"user:{st.session_state.auth_user}" if st.session_state.auth_user else f"ip:{st.session_state.client_ip}"
 
 st.sidebar.markdown("### 💬 Chats")
-conn = st.session_state.conn
+conn = _conn(DB_PATH)
 okey = owner_key()
 
 # Controls
@@ -49,10 +130,11 @@ if c1.button("➕ New"):
 if c2.button("🗑️ Delete", disabled=st.session_state.current_convo_id is None):
     if st.session_state.current_convo_id is not None:
         delete_conversation(conn, st.session_state.current_convo_id)
+        _list.clear()
         st.session_state.current_convo_id = None
         st.session_state.new_chat_mode = True
 if c3.button("🔄 Refresh"):
-    pass
+    _list.clear()  # bypass the 5 s TTL; the rerun alone would serve the cache
 
 show_archived = st.sidebar.toggle("Show archived", value=False, help="Include archived chats in the list")
 
@@ -60,7 +142,7 @@ show_archived = st.sidebar.toggle("Show archived", value=False, help="Include ar
 if "menu_open_for" not in st.session_state:
     st.session_state.menu_open_for = None
 
-convos = list_conversations(conn, okey, limit=100, include_archived=show_archived)
+convos = _list(okey, show_archived)
 
 def select_chat(cid: int):
     st.session_state.current_convo_id = cid
@@ -87,11 +169,13 @@ for cid, title, updated_at, archived in convos:
             st.session_state[f"rename_mode_{cid}"] = True
         if b2.button("Archive" if not archived else "Unarchive", key=f"arch_{cid}"):
             archive_conversation(conn, cid, archived=(not archived))
+            _list.clear()
             st.session_state.menu_open_for = None
 
         b3, b4 = box.columns(2)
         if b3.button("Delete", key=f"delete_{cid}"):
             delete_conversation(conn, cid)
+            _list.clear()
             if st.session_state.current_convo_id == cid:
                 st.session_state.current_convo_id = None
             st.session_state.menu_open_for = None
@@ -108,6 +192,7 @@ for cid, title, updated_at, archived in convos:
                 nt = new_t.strip()
                 if nt and nt != title:
                     rename_conversation(conn, cid, nt)
+                    _list.clear()
                 st.session_state[f"rename_mode_{cid}"] = False
 
 st.title("💬 LLM-Powered Financial Risk Q&A")
@@ -118,7 +203,7 @@ cid = st.session_state.current_convo_id
 if cid is None:
     st.info("Start a new chat by asking your first question. I’ll create and save it when you send.")
 else:
-    msgs = get_messages(st.session_state.conn, cid)
+    msgs = get_messages(conn, cid)
     for m in msgs:
         role = m["role"] if m["role"] in ("user", "assistant") else "assistant"
         with st.chat_message(role):
@@ -137,38 +222,46 @@ if prompt:
     # If we don't have a conversation yet, create it now, titled from the first message
     if st.session_state.current_convo_id is None:
         title = first_user_to_title(prompt)
-        st.session_state.current_convo_id = create_conversation(st.session_state.conn, owner_key(), title)
+        st.session_state.current_convo_id = create_conversation(conn, owner_key(), title)
+        _list.clear()
         st.session_state.new_chat_mode = False
+        st.session_state.was_new_convo = True
 
-    # Now persist + render user message
-    append_user_message(st.session_state.conn, st.session_state.current_convo_id, prompt)
+    # Render the user message now; it is persisted together with the
+    # assistant reply in one transaction (log_turn) once the answer arrives.
     with st.chat_message("user"):
         st.write(prompt)
 
-    # call backend
+    # call backend (streaming: tokens render as they arrive)
     with st.chat_message("assistant"):
-        status = st.status("Thinking…", expanded=False)
         try:
             t0 = time.time()
-            resp = ask_api(prompt)
+            meta = {}
+            answer = st.write_stream(ask_api_stream_bg(prompt, meta))
             dt = (time.time() - t0) * 1000.0
-            latency = resp.get("latency_ms", dt)
+            latency = meta.get("latency_ms", dt)
+            resp = {
+                "answer": answer,
+                "citations": meta.get("citations") or [],
+                "note": meta.get("note"),
+                "latency_ms": latency,
+                "top_score": meta.get("top_score"),
+            }
 
-            st.write(resp.get("answer",""))
             if resp.get("citations"):
                 st.caption("Sources: " + " • ".join(resp["citations"]))
             extra = []
             if latency is not None: extra.append(f"Latency: {latency:.0f} ms")
             if resp.get("top_score") is not None: extra.append(f"Score: {resp['top_score']:.2f}")
             if extra: st.caption("  |  ".join(extra))
-            status.update(label="Done", state="complete", expanded=False)
 
-            # persist assistant message
-            append_assistant_message(conn, st.session_state.current_convo_id, resp)
+            # persist the whole turn (user + assistant) in one commit
+            log_turn(conn, st.session_state.current_convo_id, prompt, resp)
 
-            # auto-title on first question
-            if len(get_messages(conn, st.session_state.current_convo_id)) <= 2:
+            # auto-title on first question — we already know whether this
+            # turn created the conversation, no need to re-count rows
+            if st.session_state.get("was_new_convo"):
                 rename_conversation(conn, st.session_state.current_convo_id, first_user_to_title(prompt))
+                st.session_state.was_new_convo = False
         except Exception as e:
             st.error(f"Error contacting API: {e}")
-            status.update(label="Error", state="error", expanded=True)
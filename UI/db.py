@@ -6,7 +6,6 @@ from typing import List, Tuple, Dict, Optional
 DEFAULT_DB_PATH = "data/chat_logs.db"
 
 DDL = """
-PRAGMA journal_mode=WAL;
 CREATE TABLE IF NOT EXISTS conversations (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     owner_key TEXT NOT NULL,
@@ -18,6 +17,9 @@ CREATE TABLE IF NOT EXISTS conversations (
 );
 CREATE INDEX IF NOT EXISTS idx_conversations_owner ON conversations(owner_key);
 CREATE INDEX IF NOT EXISTS idx_conversations_arch ON conversations(archived);
+-- Covers the sidebar query (WHERE owner_key[/archived] ... ORDER BY updated_at DESC)
+-- from a single range scan, no sort step.
+CREATE INDEX IF NOT EXISTS idx_conv_owner_arch_upd ON conversations(owner_key, archived, updated_at DESC);
 
 CREATE TABLE IF NOT EXISTS conv_messages (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -32,85 +34,126 @@ CREATE TABLE IF NOT EXISTS conv_messages (
     FOREIGN KEY(conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
 );
 CREATE INDEX IF NOT EXISTS idx_msgs_convo ON conv_messages(conversation_id);
+-- Makes the ORDER BY id in get_messages an index-only walk.
+CREATE INDEX IF NOT EXISTS idx_msgs_convo_id ON conv_messages(conversation_id, id);
 """
 
 def now() -> str:
     return datetime.utcnow().isoformat() + "Z"
 
+# WAL + NORMAL lets readers run alongside the writer and drops the extra
+# fsync per commit; the other pragmas keep temp/cache/reads in memory.
+# Note: WAL creates `<db>-wal` and `<db>-shm` sidecar files next to the db.
+PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "mmap_size=268435456",
+    "cache_size=-64000",
+    "busy_timeout=5000",
+    "foreign_keys=ON",
+)
+
 def connect(db_path: str = DEFAULT_DB_PATH) -> sqlite3.Connection:
     Path(db_path).parent.mkdir(parents=True, exist_ok=True)
     conn = sqlite3.connect(db_path, check_same_thread=False)
+    for p in PRAGMAS:
+        conn.execute(f"PRAGMA {p}")
     conn.executescript(DDL)
+    conn.execute("ANALYZE")  # keep planner stats fresh so it picks the composite index
     return conn
 
 def create_conversation(conn: sqlite3.Connection, owner_key: str, title: str = "New chat") -> int:
-    cur = conn.cursor()
     ts = now()
-    cur.execute(
-        "INSERT INTO conversations (owner_key, title, created_at, updated_at) VALUES (?, ?, ?, ?)",
-        (owner_key, title, ts, ts),
-    )
-    conn.commit()
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO conversations (owner_key, title, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (owner_key, title, ts, ts),
+        )
     return int(cur.lastrowid)
 
 def rename_conversation(conn: sqlite3.Connection, convo_id: int, new_title: str):
-    cur = conn.cursor()
-    cur.execute("UPDATE conversations SET title=?, updated_at=? WHERE id=?", (new_title, now(), convo_id))
-    conn.commit()
+    with conn:
+        conn.execute("UPDATE conversations SET title=?, updated_at=? WHERE id=?", (new_title, now(), convo_id))
 
 def delete_conversation(conn: sqlite3.Connection, convo_id: int):
-    cur = conn.cursor()
-    cur.execute("DELETE FROM conv_messages WHERE conversation_id=?", (convo_id,))
-    cur.execute("DELETE FROM conversations WHERE id=?", (convo_id,))
-    conn.commit()
+    with conn:
+        conn.execute("DELETE FROM conv_messages WHERE conversation_id=?", (convo_id,))
+        conn.execute("DELETE FROM conversations WHERE id=?", (convo_id,))
 
 def get_messages(conn: sqlite3.Connection, convo_id: int) -> List[Dict]:
+    # Row factory per-cursor only: name-based access here without changing
+    # what other queries return (list_conversations feeds st.cache_data,
+    # which pickles its result — sqlite3.Row is not picklable).
     cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
     cur.execute(
         "SELECT role, content, citations, latency_ms, top_score, raw_json, created_at "
         "FROM conv_messages WHERE conversation_id=? ORDER BY id ASC",
         (convo_id,),
     )
-    rows = cur.fetchall()
     msgs: List[Dict] = []
-    for role, content, citations, latency_ms, top_score, raw_json, created_at in rows:
-        item = {"role": role, "content": content, "created_at": created_at}
+    for row in cur:
+        item = {"role": row["role"], "content": row["content"], "created_at": row["created_at"]}
+        citations = row["citations"]
         if citations:
-            try: item["citations"] = json.loads(citations)
-            except Exception: item["citations"] = []
-        if latency_ms is not None: item["latency_ms"] = latency_ms
-        if top_score is not None: item["top_score"] = top_score
-        if raw_json: item["raw_json"] = raw_json
+            if citations.startswith("["):  # legacy rows stored as JSON
+                try: item["citations"] = json.loads(citations)
+                except Exception: item["citations"] = []
+            else:
+                item["citations"] = citations.split("\t")
+        if row["latency_ms"] is not None: item["latency_ms"] = row["latency_ms"]
+        if row["top_score"] is not None: item["top_score"] = row["top_score"]
+        if row["raw_json"]: item["raw_json"] = row["raw_json"]
         msgs.append(item)
     return msgs
 
-def append_user_message(conn: sqlite3.Connection, convo_id: int, content: str):
-    cur = conn.cursor()
-    cur.execute(
+def _user_row(convo_id: int, content: str):
+    return (
         "INSERT INTO conv_messages (conversation_id, role, content, created_at) VALUES (?, 'user', ?, ?)",
         (convo_id, content, now()),
     )
-    cur.execute("UPDATE conversations SET updated_at=? WHERE id=?", (now(), convo_id))
-    conn.commit()
 
-def append_assistant_message(conn: sqlite3.Connection, convo_id: int, answer_json: dict):
-    cur = conn.cursor()
-    citations = json.dumps(answer_json.get("citations", []))
-    cur.execute(
+def _assistant_row(convo_id: int, answer_json: dict):
+    return (
         "INSERT INTO conv_messages (conversation_id, role, content, citations, latency_ms, top_score, raw_json, created_at) "
         "VALUES (?, 'assistant', ?, ?, ?, ?, ?, ?)",
         (
             convo_id,
             answer_json.get("answer", ""),
-            citations,
+            # tab-joined tags ("src p.12\tsrc p.13") — no JSON parse on read
+            "\t".join(answer_json.get("citations") or []),
             float(answer_json.get("latency_ms")) if answer_json.get("latency_ms") is not None else None,
             float(answer_json.get("top_score")) if answer_json.get("top_score") is not None else None,
             json.dumps(answer_json),
             now(),
         ),
     )
-    cur.execute("UPDATE conversations SET updated_at=? WHERE id=?", (now(), convo_id))
-    conn.commit()
+
+def append_user_message(conn: sqlite3.Connection, convo_id: int, content: str):
+    sql, params = _user_row(convo_id, content)
+    with conn:
+        conn.execute(sql, params)
+        conn.execute("UPDATE conversations SET updated_at=? WHERE id=?", (now(), convo_id))
+
+def append_assistant_message(conn: sqlite3.Connection, convo_id: int, answer_json: dict):
+    sql, params = _assistant_row(convo_id, answer_json)
+    with conn:
+        conn.execute(sql, params)
+        conn.execute("UPDATE conversations SET updated_at=? WHERE id=?", (now(), convo_id))
+
+def log_turn(conn: sqlite3.Connection, convo_id: int, user_text: str, answer_json: dict):
+    """Persist a full user+assistant turn in one transaction (one fsync)."""
+    u_sql, u_params = _user_row(convo_id, user_text)
+    a_sql, a_params = _assistant_row(convo_id, answer_json)
+    with conn:
+        conn.execute(u_sql, u_params)
+        conn.execute(a_sql, a_params)
+        conn.execute("UPDATE conversations SET updated_at=? WHERE id=?", (now(), convo_id))
+
+def count_messages(conn: sqlite3.Connection, convo_id: int) -> int:
+    cur = conn.execute("SELECT COUNT(*) FROM conv_messages WHERE conversation_id=?", (convo_id,))
+    return int(cur.fetchone()[0])
 
 def first_user_to_title(prompt: str, max_len: int = 60) -> str:
     t = prompt.strip().splitlines()[0]
@@ -134,10 +177,9 @@ def list_conversations(conn, owner_key: str, limit: int = 50, include_archived:
     return cur.fetchall()
 
 def archive_conversation(conn, convo_id: int, archived: bool = True):
-    cur = conn.cursor()
-    cur.execute("UPDATE conversations SET archived=?, updated_at=? WHERE id=?",
-                (1 if archived else 0, now(), convo_id))
-    conn.commit()
+    with conn:
+        conn.execute("UPDATE conversations SET archived=?, updated_at=? WHERE id=?",
+                     (1 if archived else 0, now(), convo_id))
 
 def gen_share_token():
     import secrets
@@ -150,7 +192,7 @@ def ensure_share_token(conn, convo_id: int) -> str:
     if row and row[0]:
         return row[0]
     token = gen_share_token()
-    cur.execute("UPDATE conversations SET share_token=?, updated_at=? WHERE id=?",
-                (token, now(), convo_id))
-    conn.commit()
+    with conn:
+        conn.execute("UPDATE conversations SET share_token=?, updated_at=? WHERE id=?",
+                     (token, now(), convo_id))
     return token
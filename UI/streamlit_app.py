@@ -1,13 +1,21 @@
 # ui/streamlit_app.py
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import streamlit as st
 
 API_BASE = os.getenv("RISKQA_API_BASE", "http://localhost:8000")
 
+@st.cache_resource
+def _http() -> requests.Session:
+    # Shared keep-alive session: skips TCP setup on every API call
+    s = requests.Session()
+    s.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    return s
+
 def get_ip() -> str:
     try:
-        r = requests.get(f"{API_BASE}/whoami", timeout=3)
+        r = _http().get(f"{API_BASE}/whoami", timeout=3)
         if r.ok and "ip" in r.json():
             return r.json()["ip"]
     except Exception:
@@ -15,7 +23,7 @@ def get_ip() -> str:
     return "unknown"
 
 def ask_api(question: str) -> dict:
-    r = requests.post(f"{API_BASE}/ask", json={"question": question}, timeout=60)
+    r = _http().post(f"{API_BASE}/ask", json={"question": question}, timeout=60)
     r.raise_for_status()
     return r.json()
 
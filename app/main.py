@@ -1,16 +1,40 @@
 from fastapi import FastAPI, Body, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
-import os, time, pathlib
+import asyncio, json, os, time, pathlib
 
+import httpx
 from .schemas import AskRequest, AskResponse
 from .retrieval import retrieve
-from .generate import generate_answer, build_citations
-from openai import OpenAI
+from .generate import generate_answer, stream_answer, build_citations, citation_note
+from openai import AsyncOpenAI
 
 load_dotenv()
 app = FastAPI(title="Financial Risk Q&A")
 
+@app.on_event("startup")
+async def _warm():
+    # Preload FAISS index + meta so the first /ask doesn't pay the load cost.
+    # Tolerate a missing index (pre-build) so /health/ready still answers.
+    from .retrieval import load_meta, load_index
+    try:
+        load_meta()
+        load_index()
+    except Exception:
+        pass
+    # One shared async client: connections are pooled and reused across
+    # requests instead of a new client (and TLS handshake) per /ask.
+    key = os.getenv("OPENAI_API_KEY")
+    app.state.openai = AsyncOpenAI(
+        api_key=key,
+        http_client=httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        ),
+    ) if key else None
+
 INDEX_FILES = [pathlib.Path("data/processed/vectors.faiss"), pathlib.Path("data/processed/meta.jsonl")]
+LOW_CONF = 0.35
 
 @app.get("/health")
 def health():
@@ -28,10 +52,6 @@ def health_ready():
         "details": "index_ok requires data/processed/{vectors.faiss, meta.jsonl}",
     }
 
-def _client_or_none():
-    key = os.getenv("OPENAI_API_KEY")
-    return OpenAI(api_key=key) if key else None
-
 def _dedup_and_trim(cites, keep: int = 5):
     seen, out = set(), []
     for c in cites:
@@ -41,12 +61,12 @@ def _dedup_and_trim(cites, keep: int = 5):
     return out[:keep]
 
 @app.post("/ask", response_model=AskResponse)
-def ask(payload: AskRequest = Body(...)):
+async def ask(payload: AskRequest = Body(...)):
     t0 = time.time()
 
-    # 1) Retrieve top-k
+    # 1) Retrieve top-k (sync embed + FAISS; run off the event loop)
     try:
-        ctx = retrieve(payload.question, k=5)
+        ctx = await asyncio.to_thread(retrieve, payload.question, 5)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Retrieval error: {e}")
 
@@ -60,7 +80,6 @@ def ask(payload: AskRequest = Body(...)):
 
     # 2) Confidence gate
     top_score = float(ctx[0].get("score", 0.0))
-    LOW_CONF = 0.35
     if top_score < LOW_CONF:
         latency = (time.time() - t0) * 1000
         return AskResponse(
@@ -74,7 +93,7 @@ def ask(payload: AskRequest = Body(...)):
             top_score=top_score
         )
 
-    client = _client_or_none()
+    client = getattr(app.state, "openai", None)
     if client is None:
         latency = (time.time() - t0) * 1000
         best = ctx[0]["text"]
@@ -87,7 +106,7 @@ def ask(payload: AskRequest = Body(...)):
         )
 
     try:
-        content, usage = generate_answer(client, payload.question, ctx)
+        content, usage = await generate_answer(client, payload.question, ctx)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"LLM error: {e}")
 
@@ -102,6 +121,64 @@ def ask(payload: AskRequest = Body(...)):
         total_tokens=(usage or {}).get("total_tokens"),
     )
 
+@app.post("/ask/stream")
+async def ask_stream(payload: AskRequest = Body(...)):
+    """SSE variant of /ask: token deltas as {"delta": ...} frames, then one
+    final {"done": true, citations, top_score, latency_ms, note} frame.
+    Total work is the same as /ask but first bytes reach the UI immediately."""
+    t0 = time.time()
+
+    try:
+        ctx = await asyncio.to_thread(retrieve, payload.question, 5)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Retrieval error: {e}")
+
+    def _frame(obj: dict) -> str:
+        return f"data: {json.dumps(obj)}\n\n"
+
+    async def _gen():
+        def _done(**extra):
+            return _frame({"done": True, "latency_ms": (time.time() - t0) * 1000, **extra})
+
+        if not ctx:
+            yield _frame({"delta": "I couldn’t find relevant passages in your index."})
+            yield _done(note="Add PDFs to data/raw and rebuild the index.")
+            return
+
+        top_score = float(ctx[0].get("score", 0.0))
+        cites = _dedup_and_trim(build_citations(ctx))
+
+        if top_score < LOW_CONF:
+            yield _frame({"delta": (
+                "The retrieved context is weak or off-topic, so I won't speculate. "
+                "Please provide more relevant documents or rephrase the question."
+            )})
+            yield _done(citations=cites, top_score=top_score,
+                        note=f"Top similarity {top_score:.2f} < {LOW_CONF:.2f}.")
+            return
+
+        client = getattr(app.state, "openai", None)
+        if client is None:
+            best = ctx[0]["text"]
+            yield _frame({"delta": f"(DEV MODE: no OPENAI_API_KEY) Closest context says: {best[:700]}{'…' if len(best)>700 else ''}"})
+            yield _done(citations=cites, top_score=top_score,
+                        note="Set OPENAI_API_KEY in .env to enable grounded LLM answers.")
+            return
+
+        parts = []
+        try:
+            async for delta in stream_answer(client, payload.question, ctx):
+                parts.append(delta)
+                yield _frame({"delta": delta})
+        except Exception as e:
+            yield _frame({"error": f"LLM error: {e}"})
+        # /ask replaces uncited definition answers outright; here the text is
+        # already on screen, so surface the gate's verdict as a note instead.
+        yield _done(citations=cites, top_score=top_score,
+                    note=citation_note(payload.question, "".join(parts)))
+
+    return StreamingResponse(_gen(), media_type="text/event-stream")
+
 @app.get("/whoami")
 def whoami(request: Request):
     # If behind a proxy / load balancer, prefer X-Forwarded-For (first in list)
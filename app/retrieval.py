@@ -1,7 +1,9 @@
-import json, pathlib, os
+import base64, pathlib, os
+from functools import lru_cache
 from typing import List, Dict
 import numpy as np
 import faiss
+import orjson
 from openai import OpenAI
 from dotenv import load_dotenv
 
@@ -10,10 +12,14 @@ load_dotenv()
 DATA_DIR = pathlib.Path("data/processed")
 META_PATH = DATA_DIR / "meta.jsonl"
 FAISS_PATH = DATA_DIR / "vectors.faiss"
+VECS_PATH = DATA_DIR / "vectors.npy"
 EMBED_MODEL = "text-embedding-3-small"
+EMBED_DIM = 768  # must match scripts/build_index.py (Matryoshka truncation)
+LOW_CONF_MMR = 0.15  # candidates below this similarity are noise for MMR
 
 _index = None
 _meta: List[Dict] = []
+_vecs = None
 _client = None
 
 def _client_instance():
@@ -29,53 +35,80 @@ def load_meta() -> List[Dict]:
     global _meta
     if _meta:
         return _meta
-    items: List[Dict] = []
-    with META_PATH.open("r", encoding="utf-8") as f:
-        for line in f:
-            items.append(json.loads(line))
-    _meta = items
+    _meta = [orjson.loads(line) for line in META_PATH.read_bytes().splitlines() if line]
     return _meta
 
 def load_index():
     global _index
     if _index is None:
         _index = faiss.read_index(str(FAISS_PATH))
+        if hasattr(_index, "hnsw"):  # older flat indexes have no efSearch knob
+            _index.hnsw.efSearch = 64
+        if hasattr(_index, "nprobe"):  # IVF indexes load with nprobe=1
+            _index.nprobe = 16
     return _index
 
-def embed_query(q: str) -> np.ndarray:
+def load_vecs() -> np.ndarray:
+    """Normalized chunk vectors aligned with meta, memory-mapped from disk.
+    Lets MMR read candidate embeddings locally instead of re-embedding."""
+    global _vecs
+    if _vecs is None:
+        if VECS_PATH.exists():
+            _vecs = np.load(VECS_PATH, mmap_mode="r")
+        else:
+            # Index built before the sidecar existed: rebuild it once from
+            # the FAISS storage (flat storage supports reconstruct).
+            index = load_index()
+            _vecs = np.vstack([index.reconstruct(i) for i in range(index.ntotal)]).astype(np.float16)
+            np.save(VECS_PATH, _vecs)
+    return _vecs
+
+@lru_cache(maxsize=512)
+def _embed_query_cached(norm_q: str) -> bytes:
+    # Embeddings are deterministic, so identical questions skip the API call.
+    # Cached as bytes (hashable, ~6 KB per entry).
     client = _client_instance()
-    v = client.embeddings.create(model=EMBED_MODEL, input=[q]).data[0].embedding
-    arr = np.array([v], dtype=np.float32)
+    resp = client.embeddings.create(model=EMBED_MODEL, input=[norm_q],
+                                    dimensions=EMBED_DIM, encoding_format="base64")
+    # base64 -> frombuffer skips JSON-float parsing and per-float boxing
+    arr = np.frombuffer(base64.b64decode(resp.data[0].embedding), dtype=np.float32).reshape(1, -1).copy()
     faiss.normalize_L2(arr)
-    return arr
+    return arr.tobytes()
+
+def embed_query(q: str) -> np.ndarray:
+    raw = _embed_query_cached(q.strip().lower())
+    return np.frombuffer(raw, dtype=np.float32).reshape(1, -1).copy()
 
 def retrieve(q: str, k: int = 5) -> List[Dict]:
+    return list(_retrieve_cached(q.strip().lower(), k))
+
+@lru_cache(maxsize=512)
+def _retrieve_cached(q: str, k: int):
     meta = load_meta()
     index = load_index()
     v = embed_query(q)                  # (1, d)
-    # wider initial search
-    k_cand = max(5*k, 20)
+    # wider initial search, but never wider than the corpus
+    k_cand = min(max(5*k, 20), index.ntotal)
     scores, idxs = index.search(v, k_cand)
 
-    # Filter valid indices and collect candidate embeddings (we’ll need vectors)
+    # Filter valid indices and collect candidate embeddings (we’ll need vectors).
+    # Scores come back descending, so stop at the first near-zero-relevance
+    # candidate — MMR would never pick it and it just inflates the O(N·k) work.
     cand = []
-    vecs = []
     for score, i in zip(scores[0], idxs[0]):
         if i == -1:
             continue
+        if cand and float(score) < LOW_CONF_MMR:
+            break
         rec = meta[int(i)].copy()
         rec["score"] = float(score)
         cand.append((int(i), rec))
     if not cand:
-        return []
+        return ()
 
-    # We need the actual vectors for MMR; IndexFlatIP doesn’t expose them directly,
-    # so we re-embed the candidate texts (small cost for better ranking).
-    texts = [rec["text"] for _, rec in cand]
-    client = _client_instance()
-    embs = client.embeddings.create(model=EMBED_MODEL, input=texts)
-    vecs = np.array([d.embedding for d in embs.data], dtype=np.float32)
-    faiss.normalize_L2(vecs)
+    # Candidate vectors for MMR come straight from the stored matrix —
+    # no second embeddings API round-trip.
+    vecs = np.ascontiguousarray(load_vecs()[[i for i, _ in cand]], dtype=np.float32)
 
     # Apply MMR to choose k diverse, relevant chunks
     sel = mmr_select(vecs, v, k=k, lambda_param=0.7)
@@ -83,6 +116,44 @@ def retrieve(q: str, k: int = 5) -> List[Dict]:
     out = []
     for j in sel:
         out.append(cand[j][1])  # rec with score/source/page/text
+    return tuple(out)
+
+def retrieve_batch(queries: List[str], k: int = 5) -> List[List[Dict]]:
+    """Batched retrieve: one embeddings call and one stacked FAISS search for
+    all queries (search is internally a GEMM, so m stacked queries are much
+    cheaper than m separate calls). Returns one result list per query.
+    Useful for multi-turn context expansion / query-rewrite fan-out."""
+    if not queries:
+        return []
+    meta = load_meta()
+    index = load_index()
+    client = _client_instance()
+    resp = client.embeddings.create(model=EMBED_MODEL, input=list(queries),
+                                    dimensions=EMBED_DIM, encoding_format="base64")
+    V = np.vstack([np.frombuffer(base64.b64decode(d.embedding), dtype=np.float32) for d in resp.data])
+    faiss.normalize_L2(V)
+
+    k_cand = min(max(5*k, 20), index.ntotal)
+    scores, idxs = index.search(V, k_cand)
+
+    all_vecs = load_vecs()
+    out: List[List[Dict]] = []
+    for row in range(V.shape[0]):
+        cand = []
+        for score, i in zip(scores[row], idxs[row]):
+            if i == -1:
+                continue
+            if cand and float(score) < LOW_CONF_MMR:
+                break
+            rec = meta[int(i)].copy()
+            rec["score"] = float(score)
+            cand.append((int(i), rec))
+        if not cand:
+            out.append([])
+            continue
+        vecs = np.ascontiguousarray(all_vecs[[i for i, _ in cand]], dtype=np.float32)
+        sel = mmr_select(vecs, V[row:row+1], k=k, lambda_param=0.7)
+        out.append([cand[j][1] for j in sel])
     return out
 
 def mmr_select(embeddings: np.ndarray, query_vec: np.ndarray, k: int, lambda_param: float = 0.7):
@@ -91,25 +162,36 @@ def mmr_select(embeddings: np.ndarray, query_vec: np.ndarray, k: int, lambda_par
     query_vec:  (1, d) normalized query vector
     Returns indices of k items using Maximal Marginal Relevance.
     """
-    # Cosine sims since everything is L2-normalized
+    n = embeddings.shape[0]
+    # Cosine sims since everything is L2-normalized; one GEMM gives every
+    # candidate-candidate similarity up front instead of per-step dot products.
     sims_to_query = (embeddings @ query_vec.T).ravel()
-    selected = []
-    candidates = set(range(embeddings.shape[0]))
+    sims_matrix = embeddings @ embeddings.T  # (N, N)
+
+    mask = np.ones(n, dtype=bool)
 
     # seed with the best
     first = int(np.argmax(sims_to_query))
-    selected.append(first)
-    candidates.remove(first)
-
-    while len(selected) < min(k, embeddings.shape[0]):
-        best_idx, best_score = None, -1e9
-        for i in candidates:
-            relevance = sims_to_query[i]
-            diversity = max((embeddings[i] @ embeddings[j] for j in selected), default=0.0)
-            score = lambda_param * relevance - (1 - lambda_param) * diversity
-            if score > best_score:
-                best_score, best_idx = score, i
-        selected.append(best_idx)
-        candidates.remove(best_idx)
+    selected = [first]
+    mask[first] = False
+    max_sim_to_selected = sims_matrix[first].copy()
+
+    while len(selected) < min(k, n):
+        scores = lambda_param * sims_to_query - (1 - lambda_param) * max_sim_to_selected
+        scores[~mask] = -np.inf
+        nxt = int(np.argmax(scores))
+        selected.append(nxt)
+        mask[nxt] = False
+        np.maximum(max_sim_to_selected, sims_matrix[nxt], out=max_sim_to_selected)
 
     return selected
+
+# Warm the caches eagerly at import so the first request pays no parse cost.
+# Missing files are fine (fresh checkout, index not built yet): the lazy
+# guards above retry on the next call and /health/ready keeps working.
+try:
+    load_meta()
+    load_index()
+    load_vecs()
+except Exception:
+    pass
@@ -1,4 +1,11 @@
+import math
 from typing import Dict
+import numpy as np
+
+# z-scores for common CLs (approx) — module-level arrays so per-call code
+# does a C-level argmin instead of rebuilding a dict and scanning it
+_Z_KEYS = np.array([0.90, 0.95, 0.99, 0.995])
+_Z_VALS = np.array([1.2816, 1.6449, 2.3263, 2.5758])
 
 def lcr_ratio(hqla: float, net_outflows: float) -> Dict:
     """
@@ -14,6 +21,16 @@ def lcr_ratio(hqla: float, net_outflows: float) -> Dict:
         "explanation": f"LCR = {hqla} / {net_outflows} = {ratio:.4f}"
     }
 
+def lcr_ratio_batch(hqla, net_outflows) -> np.ndarray:
+    """
+    Vectorized LCR over aligned arrays (many scenarios / many banks).
+    Rows with non-positive outflows get NaN instead of the scalar error dict;
+    the division is branchless so NumPy's ufuncs do all the work.
+    """
+    hqla = np.asarray(hqla, dtype=np.float64)
+    net_outflows = np.asarray(net_outflows, dtype=np.float64)
+    return np.where(net_outflows > 0, hqla / np.maximum(net_outflows, 1e-300), np.nan)
+
 def toy_var(mean: float, stdev: float, horizon_days: int, cl: float) -> Dict:
     """
     Simple Gaussian VaR (didactic, not production-ready).
@@ -29,13 +46,10 @@ def toy_var(mean: float, stdev: float, horizon_days: int, cl: float) -> Dict:
     if horizon_days <= 0 or stdev < 0:
         return {"ok": False, "error": "bad inputs"}
 
-    # z-scores for common CLs (approx)
-    z_map = {0.90: 1.2816, 0.95: 1.6449, 0.99: 2.3263, 0.995: 2.5758}
-    # nearest key (simple)
-    nearest = min(z_map.keys(), key=lambda k: abs(k - cl))
-    z = z_map[nearest]
+    # nearest tabulated confidence level
+    i = int(np.argmin(np.abs(_Z_KEYS - cl)))
+    nearest, z = float(_Z_KEYS[i]), float(_Z_VALS[i])
 
-    import math
     mu = mean * horizon_days
     sigma = stdev * math.sqrt(horizon_days)
     var = -(mu + z * sigma)  # loss is positive
@@ -45,3 +59,23 @@ def toy_var(mean: float, stdev: float, horizon_days: int, cl: float) -> Dict:
         "used_confidence": nearest,
         "explanation": f"VaR ≈ -({mu:.4f} + {z:.4f} * {sigma:.4f}) = {var:.4f} (loss, clipped ≥ 0)"
     }
+
+def toy_var_batch(means, stdevs, horizon_days, cls) -> np.ndarray:
+    """
+    Vectorized toy_var over aligned arrays (e.g. scenario sweeps).
+    Same model as toy_var but one NumPy expression per step instead of a
+    Python call per scenario; invalid rows (bad cl/horizon/stdev) get NaN.
+    Returns an array of (positive) VaR losses.
+    """
+    means = np.asarray(means, dtype=np.float64)
+    stdevs = np.asarray(stdevs, dtype=np.float64)
+    horizon_days = np.asarray(horizon_days, dtype=np.float64)
+    cls = np.asarray(cls, dtype=np.float64)
+
+    z = _Z_VALS[np.argmin(np.abs(cls[:, None] - _Z_KEYS[None, :]), axis=1)]
+    mu = means * horizon_days
+    sigma = stdevs * np.sqrt(horizon_days)
+    var = np.maximum(-(mu + z * sigma), 0.0)
+
+    bad = (cls <= 0.0) | (cls >= 1.0) | (horizon_days <= 0) | (stdevs < 0)
+    return np.where(bad, np.nan, var)
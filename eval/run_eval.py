@@ -1,37 +1,56 @@
-import json, time, statistics, pathlib, requests
+import re, time, pathlib, requests
+import numpy as np
+import orjson
+from requests.adapters import HTTPAdapter
 
 API = "http://localhost:8000/ask"
 DATA = pathlib.Path("eval/testset.jsonl")
 
+# one keep-alive session: no TCP handshake per question, and the pool is
+# ready if the eval loop is ever parallelized
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
 def ask(q: str):
     t0 = time.time()
-    r = requests.post(API, json={"question": q}, timeout=60)
+    r = _SESSION.post(API, json={"question": q}, timeout=60)
     dt = (time.time() - t0) * 1000
     r.raise_for_status()
     return r.json(), dt
 
-def has_citation_text(ans: str):
-    return "(" in ans and " p." in ans and ")" in ans
+# matches an actual "(source p.12)"-shaped citation in one scan, instead of
+# three independent substring passes that also accepted ") ... p. ... ("
+_CIT_RE = re.compile(r"\([^)]*\bp\.\s*\d+[^)]*\)")
+
+def has_citation_text(ans: str) -> bool:
+    return _CIT_RE.search(ans) is not None
 
 def main():
     latencies = []
     ok, total = 0, 0
-    for line in DATA.read_text(encoding="utf-8").splitlines():
-        total += 1
-        j = json.loads(line)
-        q = j["q"]
-        expect_cit = j.get("expect_citation", True)
-        res, dt = ask(q)
-        latencies.append(dt)
-        ans = res.get("answer","")
-        # minimal groundedness check
-        cited = has_citation_text(ans)
-        passed = (cited == expect_cit)
-        print(f"- Q: {q}\n  cited={cited}, expect={expect_cit}, latency_ms={dt:.0f}")
-        if passed:
-            ok += 1
-
-    print(f"\nPassed {ok}/{total} | p50={statistics.median(latencies):.0f}ms p95={statistics.quantiles(latencies, n=20)[18]:.0f}ms")
+    # stream line by line: no full-file string + line-list in memory
+    with DATA.open("rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            total += 1
+            j = orjson.loads(line)
+            q = j["q"]
+            expect_cit = j.get("expect_citation", True)
+            res, dt = ask(q)
+            latencies.append(dt)
+            ans = res.get("answer","")
+            # minimal groundedness check
+            cited = has_citation_text(ans)
+            passed = (cited == expect_cit)
+            print(f"- Q: {q}\n  cited={cited}, expect={expect_cit}, latency_ms={dt:.0f}")
+            if passed:
+                ok += 1
+
+    # one contiguous array + one C-level sort for both percentiles
+    p50, p95 = np.percentile(np.asarray(latencies, dtype=np.float64), [50, 95])
+    print(f"\nPassed {ok}/{total} | p50={p50:.0f}ms p95={p95:.0f}ms")
 
 if __name__ == "__main__":
     main()
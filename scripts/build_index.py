@@ -1,11 +1,18 @@
 #!/usr/bin/env python3
-import os, json, pathlib
-from typing import List, Dict
+import argparse, asyncio, base64, functools, hashlib, math, os, pathlib, shelve
+import orjson
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Tuple
 from dotenv import load_dotenv
 from pypdf import PdfReader
+try:
+    import fitz  # PyMuPDF: ~30x faster text extraction than pypdf
+except ImportError:
+    fitz = None
+import httpx
 import numpy as np
 import faiss
-from openai import OpenAI
+from openai import AsyncOpenAI, RateLimitError
 import tiktoken
 
 # 1) setup
@@ -13,105 +20,290 @@ load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise SystemExit("Missing OPENAI_API_KEY in .env")
-client = OpenAI(api_key=api_key)
 
 RAW_DIR = pathlib.Path("data/raw")
 OUT_DIR = pathlib.Path("data/processed")
 OUT_DIR.mkdir(parents=True, exist_ok=True)
 META_PATH = OUT_DIR / "meta.jsonl"
 FAISS_PATH = OUT_DIR / "vectors.faiss"
-EMBED_MODEL = "text-embedding-3-small"  # 1536-dim, cost-efficient
+VECS_PATH = OUT_DIR / "vectors.npy"
+CACHE_PATH = OUT_DIR / "embed_cache"  # shelve adds its own suffix
+EMBED_MODEL = "text-embedding-3-small"  # cost-efficient
+# Server-side Matryoshka truncation: 768 dims keep nearly all retrieval
+# quality at half the index size, bandwidth and scan cost. Must match
+# app/retrieval.py — rebuild the index after changing this.
+EMBED_DIM = 768
 
 # 2) simple chunker: ~900 words, 200 words overlap
-def chunk_text_tokenwise(text: str, max_tokens: int = 700, overlap_tokens: int = 150, model: str = "gpt-4o-mini") -> list:
-    enc = tiktoken.encoding_for_model(model) if model in tiktoken.list_encoding_names() else tiktoken.get_encoding("cl100k_base")
+@functools.lru_cache(maxsize=None)
+def _enc(model: str = "gpt-4o-mini"):
+    # Building an encoding walks the whole mergeable-tokens table; do it once
+    # per process (workers included), not once per page.
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
 
+def chunk_text_tokenwise(text: str, max_tokens: int = 700, overlap_tokens: int = 150, model: str = "gpt-4o-mini") -> Iterator[str]:
+    """Yield cleaned chunk strings lazily — callers never hold more than the
+    current window, and already-stripped/empty chunks never leave here."""
+    enc = _enc(model)
 
     # Soft split by paragraphs first
     paras = [p.strip() for p in text.split("\n\n") if p.strip()]
-    pieces = []
-    for p in paras:
-        toks = enc.encode(p)
-        # If a single paragraph is huge, hard-split it
-        if len(toks) <= max_tokens:
-            pieces.append(toks)
-        else:
-            i = 0
-            while i < len(toks):
-                pieces.append(toks[i:i+max_tokens])
-                i += max_tokens - overlap_tokens
-
-    # Now merge small paragraphs until we’re close to max_tokens
-    merged, cur = [], []
-    for toks in pieces:
-        if len(cur) + len(toks) <= max_tokens:
-            cur += toks
-        else:
-            if cur:
-                merged.append(cur)
-                # start next chunk with overlap from end of previous
-                cur = cur[-overlap_tokens:] + toks
-            else:
-                merged.append(toks)
-                cur = []
-    if cur:
-        merged.append(cur)
-
-    # Decode back to strings
-    out = []
-    for toks in merged:
-        out.append(enc.decode(toks))
-    return out
-
-# 3) read PDF pages -> chunks with metadata
-def pdf_to_chunks(pdf_path: pathlib.Path) -> List[Dict]:
+    if not paras:
+        return
+
+    # Single streaming pass over a rolling token window: paragraphs fill the
+    # current chunk, and whenever it reaches max_tokens we emit it and carry
+    # the overlap tail forward. Each token is touched once (plus the small
+    # overlap copy), instead of the old split-then-merge double pass.
+    # One batch call amortizes the Python<->Rust crossing over all paragraphs.
+    cur: list = []
+    has_new = False  # does cur hold anything beyond the carried overlap tail?
+    for toks in enc.encode_ordinary_batch(paras):
+        i, n = 0, len(toks)
+        while i < n:
+            space = max_tokens - len(cur)
+            cur += toks[i:i+space]
+            i += space
+            has_new = True
+            if len(cur) >= max_tokens:
+                ch = enc.decode(cur).strip()
+                if ch:
+                    yield ch
+                cur = cur[-overlap_tokens:] if overlap_tokens else []
+                has_new = False
+    if cur and has_new:
+        ch = enc.decode(cur).strip()
+        if ch:
+            yield ch
+
+# 3) read PDF pages -> chunks with metadata.
+# PyMuPDF is the default backend when installed; set PDF_BACKEND=pypdf to
+# force the pure-Python fallback (e.g. where PyMuPDF's AGPL is a concern).
+PDF_BACKEND = os.getenv("PDF_BACKEND", "pymupdf" if fitz else "pypdf")
+
+def _page_count(pdf_path: pathlib.Path) -> int:
+    if PDF_BACKEND == "pymupdf" and fitz is not None:
+        with fitz.open(str(pdf_path)) as doc:
+            return doc.page_count
+    return len(PdfReader(str(pdf_path)).pages)
+
+def _extract_pages(pdf_path: pathlib.Path, start: int, end: int) -> List[str]:
+    if PDF_BACKEND == "pymupdf" and fitz is not None:
+        with fitz.open(str(pdf_path)) as doc:
+            return [doc[p].get_text("text") for p in range(start, end)]
     reader = PdfReader(str(pdf_path))
-    out: List[Dict] = []
-    for p, page in enumerate(reader.pages, start=1):
-        raw = page.extract_text() or ""
-        for ch in chunk_text_tokenwise(raw):
-            ch = ch.strip()
-            if ch:
-                out.append({"text": ch, "source": pdf_path.name, "page": p})
-    return out
-
-# 4) embed in batches
-def embed_texts(texts: List[str], batch: int = 128) -> np.ndarray:
-    vecs: List[List[float]] = []
-    for i in range(0, len(texts), batch):
+    return [reader.pages[p].extract_text() or "" for p in range(start, end)]
+
+def _pages_to_chunks(args: Tuple[pathlib.Path, int, int]) -> List[Dict]:
+    # Worker: extract + chunk a 0-based page range [start, end).
+    # Opens its own document handle — neither backend's objects pickle.
+    # (materialized to a list so the result can pickle back from the pool)
+    pdf_path, start, end = args
+    return [
+        {"text": ch, "source": pdf_path.name, "page": p + 1}
+        for p, raw in enumerate(_extract_pages(pdf_path, start, end), start=start)
+        for ch in chunk_text_tokenwise(raw)
+    ]
+
+def pdf_to_chunks(pdf_path: pathlib.Path) -> List[Dict]:
+    return _pages_to_chunks((pdf_path, 0, _page_count(pdf_path)))
+
+# 4) embed in batches — batches fly concurrently (bounded by a semaphore)
+# over pooled keep-alive connections, so each request's RTT overlaps
+MAX_INFLIGHT = 16
+
+async def _embed_all(texts: List[str], batch: int) -> np.ndarray:
+    # HTTP/2 multiplexes the concurrent batches over a few keep-alive
+    # connections (no per-request TCP/TLS setup), and transport-level
+    # retries absorb transient socket errors below the RateLimitError loop.
+    client = AsyncOpenAI(
+        api_key=api_key,
+        http_client=httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                retries=3,
+                http2=True,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+            ),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        ),
+    )
+    sem = asyncio.Semaphore(MAX_INFLIGHT)
+
+    # Preallocate the full matrix and have each batch write its own slice —
+    # no list-of-lists holding every float through the interpreter first.
+    arr = np.empty((len(texts), EMBED_DIM), dtype=np.float32)
+
+    async def _one_batch(i: int):
         part = texts[i:i+batch]
-        resp = client.embeddings.create(model=EMBED_MODEL, input=part)
-        vecs.extend([d.embedding for d in resp.data])
-    arr = np.array(vecs, dtype=np.float32)
-    # normalize so dot product = cosine similarity
-    faiss.normalize_L2(arr)
+        delay = 1.0
+        async with sem:
+            while True:
+                try:
+                    resp = await client.embeddings.create(
+                        model=EMBED_MODEL, input=part,
+                        dimensions=EMBED_DIM, encoding_format="base64",
+                    )
+                    # base64 -> frombuffer: one memcpy per vector, no
+                    # JSON-float parsing of 768 numbers each
+                    block = np.stack([
+                        np.frombuffer(base64.b64decode(d.embedding), dtype=np.float32)
+                        for d in resp.data
+                    ])
+                    # normalize while the batch is still cache-hot (dot
+                    # product = cosine) instead of a full extra pass later
+                    block /= np.linalg.norm(block, axis=1, keepdims=True) + 1e-12
+                    arr[i:i+batch] = block
+                    return
+                except RateLimitError:
+                    if delay > 60:
+                        raise
+                    await asyncio.sleep(delay)
+                    delay *= 2
+
+    try:
+        await asyncio.gather(*[_one_batch(i) for i in range(0, len(texts), batch)])
+    finally:
+        await client.close()
     return arr
 
-def main():
-    # gather chunks from all PDFs
+def _chunk_key(text: str) -> str:
+    # blake2b is the fastest stdlib hash; model+dims in the key so changing
+    # either invalidates the cache naturally
+    h = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+    return f"{EMBED_MODEL}:{EMBED_DIM}:{h}"
+
+def embed_texts(texts: List[str], batch: int = 128) -> np.ndarray:
+    # Content-addressed cache: re-runs only pay the API for chunks whose
+    # text actually changed (e.g. one new PDF added to data/raw).
+    arr = np.empty((len(texts), EMBED_DIM), dtype=np.float32)
+    with shelve.open(str(CACHE_PATH)) as cache:
+        keys = [_chunk_key(t) for t in texts]
+        missing = []
+        for i, k in enumerate(keys):
+            vec = cache.get(k)
+            if vec is None:
+                missing.append(i)
+            else:
+                arr[i] = np.frombuffer(vec, dtype=np.float32)
+        if missing:
+            print(f"  {len(texts) - len(missing)} cached, embedding {len(missing)} new chunks ...")
+            new_vecs = asyncio.run(_embed_all([texts[i] for i in missing], batch))
+            for j, i in enumerate(missing):
+                arr[i] = new_vecs[j]
+                cache[keys[i]] = new_vecs[j].tobytes()
+    return arr
+
+def _gpu_count() -> int:
+    try:
+        return faiss.get_num_gpus()
+    except AttributeError:  # faiss-cpu build
+        return 0
+
+def build_faiss_index(X: np.ndarray, index_type: str = "hnsw"):
+    """hnsw (default): >95% recall at a fraction of the flat-scan cost.
+    ivfpq: partitioned + product-quantized, ~60x smaller — for large corpora
+    (needs enough vectors to train; prefer hnsw under ~50k chunks).
+    sq-fp16 / sq-int8: scalar-quantized flat scan at 1/2 or 1/4 the memory.
+    flat: exact scan, kept for correctness checks."""
+    n, dim = X.shape
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif index_type in ("sq-fp16", "sq-int8"):
+        # scalar-quantized flat scan: 2x (fp16) or 4x (int8) less memory
+        # bandwidth per query, near-identical recall for normalized vectors
+        qt = faiss.ScalarQuantizer.QT_fp16 if index_type == "sq-fp16" else faiss.ScalarQuantizer.QT_8bit
+        index = faiss.IndexScalarQuantizer(dim, qt, faiss.METRIC_INNER_PRODUCT)
+        index.train(X)
+    elif index_type == "ivfpq":
+        quantizer = faiss.IndexFlatIP(dim)
+        nlist = max(64, int(4 * math.sqrt(n)))
+        # 64 subquantizers x 8 bits; the metric must be passed explicitly —
+        # an IP quantizer alone still leaves the index on METRIC_L2.
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, 64, 8, faiss.METRIC_INNER_PRODUCT)
+        if _gpu_count() > 0:
+            # train/add are the expensive steps for IVFPQ; do them GPU-resident
+            # and bring the finished index back for write_index. Flat/HNSW adds
+            # are just memcpy/graph-build — not worth the PCIe transfer.
+            res = faiss.StandardGpuResources()
+            gpu_index = faiss.index_cpu_to_gpu(res, 0, index)
+            gpu_index.train(X)
+            for s in range(0, n, 1_000_000):  # stay inside the GPU memory envelope
+                gpu_index.add(X[s:s+1_000_000])
+            index = faiss.index_gpu_to_cpu(gpu_index)
+            index.nprobe = 16
+            return index
+        index.train(X)
+        index.nprobe = 16
+    else:
+        index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = 200
+    index.add(X)
+    return index
+
+def main(index_type: str = "hnsw"):
+    # gather chunks from all PDFs; extract_text is CPU-bound and
+    # single-threaded, so fan PDFs (or pages of a lone PDF) out to processes
+    pdf_paths = sorted(RAW_DIR.glob("**/*.pdf"))
+    if not pdf_paths:
+        raise SystemExit("No PDFs in data/raw. Add some and re-run.")
+
+    workers = os.cpu_count() or 1
     all_chunks: List[Dict] = []
-    for p in sorted(RAW_DIR.glob("**/*.pdf")):
-        print(f"Reading {p} ...")
-        all_chunks.extend(pdf_to_chunks(p))
+    if len(pdf_paths) == 1 and workers > 1:
+        # single PDF: split its pages across workers, order kept by map
+        p = pdf_paths[0]
+        n_pages = _page_count(p)
+        step = max(1, -(-n_pages // workers))
+        ranges = [(p, s, min(s + step, n_pages)) for s in range(0, n_pages, step)]
+        print(f"Reading {p} ({n_pages} pages across {len(ranges)} workers) ...")
+        with ProcessPoolExecutor(max_workers=len(ranges)) as ex:
+            for chunks in ex.map(_pages_to_chunks, ranges):
+                all_chunks.extend(chunks)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            for p, chunks in zip(pdf_paths, ex.map(pdf_to_chunks, pdf_paths, chunksize=1)):
+                print(f"Read {p}: {len(chunks)} chunks")
+                all_chunks.extend(chunks)
 
     if not all_chunks:
-        raise SystemExit("No PDFs in data/raw. Add some and re-run.")
+        raise SystemExit("PDFs in data/raw contained no extractable text.")
 
     texts = [c["text"] for c in all_chunks]
     print(f"Embedding {len(texts)} chunks ...")
     X = embed_texts(texts)
 
     # build FAISS index (inner product after normalization = cosine)
-    dim = X.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(X)
+    print(f"Building {index_type} index for {X.shape[0]} vectors ...")
+    faiss.omp_set_num_threads(os.cpu_count() or 1)  # train/add can use all cores
+    X = np.ascontiguousarray(X, dtype=np.float32)   # no internal copy in add()
+    index = build_faiss_index(X, index_type)
     faiss.write_index(index, str(FAISS_PATH))
 
-    with META_PATH.open("w", encoding="utf-8") as f:
+    # Sidecar with the normalized vectors so retrieval can fetch candidate
+    # embeddings locally (MMR) instead of re-embedding via the API. Stored
+    # as float16: half the footprint, and it doubles as a cheap source for
+    # re-indexing without re-embedding. open_memmap streams the downcast
+    # straight to disk in slices (no transient fp16 copy of the whole
+    # matrix) and keeps the .npy header, so the app side can keep doing
+    # np.load(..., mmap_mode="r") and only page in rows it actually reads.
+    mm = np.lib.format.open_memmap(VECS_PATH, mode="w+", dtype=np.float16, shape=X.shape)
+    for s in range(0, X.shape[0], 100_000):
+        mm[s:s+100_000] = X[s:s+100_000]
+    mm.flush()
+    del mm
+
+    # orjson per record into a 1 MB buffered writer: one syscall per MB
+    # instead of one per line, without materializing the whole file in RAM
+    with open(META_PATH, "wb", buffering=1 << 20) as f:
         for rec in all_chunks:
-            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            f.write(orjson.dumps(rec, option=orjson.OPT_APPEND_NEWLINE))
 
-    print(f"✅ Wrote {FAISS_PATH} and {META_PATH}")
+    print(f"✅ Wrote {FAISS_PATH}, {VECS_PATH} and {META_PATH}")
 
 if __name__ == "__main__":
-    main()
+    ap = argparse.ArgumentParser(description="Build the FAISS index from PDFs in data/raw")
+    ap.add_argument("--index-type", choices=["hnsw", "ivfpq", "sq-fp16", "sq-int8", "flat"], default="hnsw")
+    main(ap.parse_args().index_type)